@@ -0,0 +1,92 @@
+import logging
+
+import ollama
+
+
+class OllamaBackend:
+    """
+    LLM backend that talks to a local Ollama server.
+
+    Backends expose chat(messages), returning an iterator of response text
+    fragments, and warm_up(), which loads the model ahead of the first turn.
+    Note that Ollama serves requests serially, so concurrent users queue
+    behind each other.
+    """
+
+    def __init__(self, model, keep_alive=None, options=None):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.options = options
+
+    def chat(self, messages):
+        """
+        Stream a chat completion from Ollama.
+        :param messages: The conversation messages to send.
+        :return: An iterator of response text fragments.
+        """
+        stream = ollama.chat(model=self.model, stream=True, messages=messages,
+                             keep_alive=self.keep_alive, options=self.options)
+        for chunk in stream:
+            yield chunk['message']['content']
+
+    def warm_up(self):
+        """
+        Load the model weights without generating anything.
+        :return: None
+        """
+        ollama.chat(model=self.model, messages=[], keep_alive=self.keep_alive)
+
+
+class VLLMBackend:
+    """
+    LLM backend for an OpenAI-compatible server such as vLLM or TGI.
+
+    These servers batch concurrent requests, so turns from multiple users
+    share a prefill instead of queueing behind each other as with Ollama.
+    """
+
+    def __init__(self, model, base_url, max_tokens=None):
+        # Imported here so the openai package is only required when this
+        # backend is selected in the config.
+        from openai import OpenAI
+        self.model = model
+        self.max_tokens = max_tokens
+        self.client = OpenAI(base_url=base_url, api_key="EMPTY")
+
+    def chat(self, messages):
+        """
+        Stream a chat completion from the OpenAI-compatible server.
+        :param messages: The conversation messages to send.
+        :return: An iterator of response text fragments.
+        """
+        stream = self.client.chat.completions.create(model=self.model, messages=messages,
+                                                     stream=True, max_tokens=self.max_tokens)
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    def warm_up(self):
+        """
+        OpenAI-compatible servers keep weights resident; nothing to do.
+        :return: None
+        """
+
+
+def create_backend(config, model, keep_alive=None, options=None):
+    """
+    Create the LLM backend selected in the config.
+    :param config: The parsed config.ini.
+    :param model: The model name to use.
+    :param keep_alive: How long Ollama should keep the model loaded.
+    :param options: Ollama generation options.
+    :return: The configured backend instance.
+    """
+    backend_name = config.get('LLM', 'backend', fallback='ollama')
+    if backend_name == 'vllm':
+        base_url = config.get('LLM', 'vllm_url', fallback='http://localhost:8000/v1')
+        max_tokens = options.get('num_predict') if options else None
+        return VLLMBackend(model, base_url, max_tokens=max_tokens)
+    if backend_name != 'ollama':
+        logging.warning(f"Unknown LLM backend '{backend_name}', falling back to Ollama")
+    return OllamaBackend(model, keep_alive=keep_alive, options=options)
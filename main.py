@@ -1,25 +1,37 @@
 import configparser
-import ollama
+import ctranslate2
 import speech_recognition as sr
-import whisper
+import webrtcvad
+from faster_whisper import WhisperModel
 from gradio_client import Client
-from pydub import AudioSegment
 import sounddevice as sd
-from scipy.io import wavfile
+import soundfile as sf
+from math import gcd
+from scipy.signal import resample_poly
+from llm_backend import create_backend
 from short_term_memory import load_conversation_history, save_conversation_history
+import itertools
 import logging
+import os
+import queue
+import re
+import threading
 import time
-import wave
-import tempfile
 import numpy as np
 
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
-model = whisper.load_model("base")
-
-# Load configuration
-config = configparser.ConfigParser()
+DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+# CTranslate2's Whisper runtime fuses the attention kernels and combines int8
+# weights with FP16 activations on GPU (plain int8 on CPU), well ahead of the
+# reference openai-whisper implementation at the same accuracy.
+model = WhisperModel("base", device=DEVICE,
+                     compute_type="int8_float16" if DEVICE == "cuda" else "int8")
+
+# Load configuration. Inline comments are stripped so annotated values like
+# filtered_chars don't leak the comment text into the setting.
+config = configparser.ConfigParser(inline_comment_prefixes=("#",))
 config.read('config.ini')
 
 # Access configuration values
@@ -32,10 +44,53 @@ INPUT_DEVICE_INDEX = config.getint('DEFAULT', 'input_device_index')
 OUTPUT_DEVICE_INDEX = config.getint('DEFAULT', 'output_device_index')
 APPLIO_TTS_OUTPUT_PATH = config['DEFAULT']['applio_tts_output_path']
 APPLIO_RVC_OUTPUT_PATH = config['DEFAULT']['applio_rvc_output_path']
-FILTERED_CHARS = config['DEFAULT']['filtered_chars']
-
-# Initialize Gradio Client for Applio
-client = Client(config['GRADIO_CLIENT']['url'])
+# Frozenset gives O(1) C-level membership and deduplicates the config value
+FILTERED_CHARS = frozenset(config['DEFAULT']['filtered_chars'])
+
+# Rough token budget for the conversation history sent to Ollama
+MAX_HISTORY_TOKENS = 2048
+
+# Keep the Ollama model resident between turns instead of letting it unload
+# after the default 5 minutes, and bound context/generation so prefill stays
+# cheap. num_ctx matches the history token budget above.
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_OPTIONS = {
+    "num_ctx": MAX_HISTORY_TOKENS,
+    "num_predict": 256,
+    "num_thread": os.cpu_count(),
+}
+
+# LLM backend selected via [LLM] in config.ini: Ollama by default, or an
+# OpenAI-compatible server (vLLM/TGI) for multi-user deployments.
+LLM_BACKEND = create_backend(config, OLLAMA_MODEL,
+                             keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS)
+
+# VAD endpointing: 30 ms frames at 16 kHz mono, utterance ends after
+# ~180 ms of trailing silence instead of the recognizer's ~800 ms pause.
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+VAD_FRAME_SAMPLES = VAD_SAMPLE_RATE * VAD_FRAME_MS // 1000
+VAD_TRAILING_SILENCE_FRAMES = 6
+
+# Reuse one Recognizer and Microphone across turns; constructing a
+# Microphone re-enumerates audio devices through PyAudio every time.
+_recognizer = sr.Recognizer()
+_microphone = sr.Microphone(device_index=INPUT_DEVICE_INDEX)
+
+# Symbols allowed through the response filter besides letters and digits.
+# The pattern is compiled once at import so filtering is a single C-level
+# scan instead of a per-character Python loop.
+_KEPT_SYMBOLS = " ?!.,:;-'*"
+_FILTER_PATTERN = re.compile(
+    f"[^\\w{re.escape(_KEPT_SYMBOLS)}]|_"
+    + (f"|[{re.escape(''.join(FILTERED_CHARS))}]" if FILTERED_CHARS else "")
+)
+
+# Initialize Gradio Client for Applio once at import so the HTTP session and
+# API schema are reused across turns. Applio writes its output WAV directly to
+# the paths we pass, so there is no point downloading result files back over
+# HTTP as well.
+client = Client(config['GRADIO_CLIENT']['url'], download_files=False)
 
 
 def time_wrapper(func):
@@ -55,14 +110,14 @@ def time_wrapper(func):
 
 
 @time_wrapper
-def get_ollama_response(prompt, user_id, model=OLLAMA_MODEL, conversation_history=None):
+def get_llm_response(prompt, user_id, conversation_history=None, on_sentence=None):
     """
-    Get a response from Ollama given a prompt and user ID.
+    Get a response from the configured LLM backend given a prompt and user ID.
     :param prompt: Your input prompt.
     :param user_id: The ID of the user.
-    :param model: The Ollama model to use.
     :param conversation_history: The conversation history dictionary.
-    :return: The response from Ollama.
+    :param on_sentence: Optional callback invoked with each complete sentence as it streams in.
+    :return: The response from the LLM.
     """
     try:
         # Initialize user conversation history if not already present
@@ -70,26 +125,49 @@ def get_ollama_response(prompt, user_id, model=OLLAMA_MODEL, conversation_histor
             conversation_history[user_id] = []
 
         # shorten conversation history to last 3 messages + first message
-        if len(conversation_history[user_id]) > 3:
-            shortened_history = conversation_history[user_id][-3:]
-            shortened_history.insert(0, conversation_history[user_id][0])
+        history = conversation_history[user_id]
+        if len(history) > 3:
+            history = [history[0]] + history[-3:]
+
+        # Enforce a hard token budget (~4 chars per token) so prefill cost
+        # stays bounded no matter how long individual messages get.
+        def estimated_tokens():
+            return sum(len(message['content']) // 4 for message in history)
 
+        while len(history) > 2 and estimated_tokens() > MAX_HISTORY_TOKENS:
+            del history[1]
+
+        conversation_history[user_id] = history
 
         # Add user message to conversation history
         conversation_history[user_id].append({'role': 'user', 'content': START_PROMPT + prompt})
 
-        # Get the response from Ollama without streaming
-        ollama_response = ollama.chat(model=model, stream=False, messages=conversation_history[user_id])
-
-        # Directly extract the response content
-        response_content = ollama_response['message']['content']
+        # Stream the response so each sentence can go to TTS while
+        # later tokens are still being generated.
+        response_parts = []
+        buffer = ""
+        for token in LLM_BACKEND.chat(conversation_history[user_id]):
+            response_parts.append(token)
+            buffer += token
+            while True:
+                cut = next((i for i, char in enumerate(buffer) if char in ".?!\n"), None)
+                if cut is None:
+                    break
+                sentence, buffer = buffer[:cut + 1].strip(), buffer[cut + 1:]
+                if sentence and on_sentence:
+                    on_sentence(sentence)
+        # Flush whatever is left after the stream ends
+        if buffer.strip() and on_sentence:
+            on_sentence(buffer.strip())
+
+        response_content = "".join(response_parts)
 
         # Add assistant's response to conversation history
         conversation_history[user_id].append({'role': 'assistant', 'content': response_content})
 
         return response_content
     except Exception as e:
-        logging.error(f"[OLLAMA] An error occurred while getting a response from Ollama: {e}")
+        logging.error(f"[LLM] An error occurred while getting a response from the LLM: {e}")
         return "[ERROR] Failed to get response."
 
 
@@ -136,56 +214,83 @@ def convert_text_to_speech(text, output_tts_path, output_rvc_path):
         return None
 
 
-@time_wrapper
-def resample_audio(file_path, target_sample_rate=44100):
+def play_audio(file_path, output_device=None, target_sample_rate=44100):
     """
-    Resample an audio file to a target sample rate.
-    :param file_path: File path of the audio file to resample.
-    :param target_sample_rate: The target sample rate.
-    :return: The path to the resampled audio file.
+    Play an audio file using the sounddevice library, resampling in memory if needed.
+    :param file_path: File path of the audio file to play.
+    :param output_device: The output device index to use.
+    :param target_sample_rate: The sample rate the output device expects.
+    :return: None
     """
     try:
-        audio = AudioSegment.from_file(file_path)
-        audio = audio.set_frame_rate(target_sample_rate)
-        try:
-            resampled_path = file_path.replace(".wav", "_resampled.wav")
-            audio.export(resampled_path, format="wav")
-        except IOError as e:
-            logging.error(f"Error exporting resampled audio: {e}")
-            logging.info("Exporting to default path: non_resampled.wav")
-            audio.export("non_resampled.wav", format="wav")
-            return "non_resampled.wav"
-        return resampled_path
+        with sf.SoundFile(file_path) as audio_file:
+            if audio_file.samplerate == target_sample_rate:
+                # Stream the file in blocks so the first samples reach the
+                # DAC after one block instead of waiting for the whole WAV.
+                with sd.OutputStream(samplerate=audio_file.samplerate, channels=audio_file.channels,
+                                     device=output_device, dtype='int16') as stream:
+                    block = audio_file.read(4096, dtype='int16')
+                    while len(block):
+                        stream.write(block)
+                        block = audio_file.read(4096, dtype='int16')
+                return
+            # Rate mismatch: resample in memory and play the result directly
+            # instead of writing an intermediate resampled WAV back to disk.
+            data = audio_file.read(dtype='int16')
+            divisor = gcd(audio_file.samplerate, target_sample_rate)
+            data = resample_poly(data, target_sample_rate // divisor,
+                                 audio_file.samplerate // divisor, axis=0).astype(np.int16)
+            channels = data.shape[1] if data.ndim > 1 else 1
+            with sd.OutputStream(samplerate=target_sample_rate, channels=channels,
+                                 device=output_device, dtype='int16') as stream:
+                stream.write(data)
     except Exception as e:
-        logging.error(f"Could not resample audio: {e}")
-        return None
+        logging.error(f"Could not play audio: {e}")
 
 
-def play_audio(file_path, output_device=None):
+def listen_vad(input_device=INPUT_DEVICE_INDEX):
     """
-    Play an audio file using the sounddevice library.
-    :param file_path: File path of the audio file to play.
-    :param output_device: The output device index to use.
-    :return: None
+    Capture a single utterance from the microphone using WebRTC VAD endpointing.
+    :param input_device: The input device index to use.
+    :return: The captured speech as a 16 kHz mono float32 array, or None on failure.
     """
     try:
-        sample_rate, audio_data = wavfile.read(file_path)
-        sd.play(audio_data, samplerate=sample_rate, device=output_device)
-        sd.wait()
+        vad = webrtcvad.Vad(3)
+        frames = []
+        silence_run = 0
+        speech_started = False
+        logging.info("Listening...")
+        with sd.InputStream(samplerate=VAD_SAMPLE_RATE, channels=1, dtype='int16',
+                            device=input_device, blocksize=VAD_FRAME_SAMPLES) as stream:
+            while True:
+                frame, _ = stream.read(VAD_FRAME_SAMPLES)
+                frame = frame.reshape(-1)
+                if vad.is_speech(frame.tobytes(), VAD_SAMPLE_RATE):
+                    speech_started = True
+                    silence_run = 0
+                    frames.append(frame)
+                elif speech_started:
+                    silence_run += 1
+                    frames.append(frame)
+                    if silence_run >= VAD_TRAILING_SILENCE_FRAMES:
+                        break
+        logging.info("Audio captured.")
+        return np.concatenate(frames).astype(np.float32) / 32768.0
     except Exception as e:
-        logging.error(f"Could not play audio: {e}")
+        logging.error(f"Could not capture audio: {e}")
+        return None
 
 
-def speech_to_text_whisper(audio_file):
+def speech_to_text_whisper(audio):
     """
     Convert speech to text using the Whisper model.
-    :param audio_file: The path to the audio file to transcribe.
+    :param audio: The audio to transcribe, as a file path or 16 kHz float32 array.
     :return: The recognized text or None if not recognized.
     """
     try:
         logging.info("Transcribing audio using Whisper...")
-        result = model.transcribe(audio_file)  # Pass the path of the audio file
-        text = result['text']
+        segments, _ = model.transcribe(audio, beam_size=1, vad_filter=True)
+        text = "".join(segment.text for segment in segments)
         logging.info(f"Transcribed text: {text}")
         return text
     except Exception as e:
@@ -201,35 +306,27 @@ def speech_to_text(input_device=INPUT_DEVICE_INDEX, mode="sr"):
     :param mode: The mode of transcription ('sr' for SpeechRecognition or 'whisper' for Whisper).
     :return: The recognized text or None if not recognized.
     """
-    recognizer = sr.Recognizer()
+    if mode == "whisper":
+        # VAD endpointing hands Whisper a 16 kHz array the moment the user
+        # stops speaking, with almost no trailing silence to decode.
+        samples = listen_vad(input_device)
+        if samples is None:
+            return None
+        return speech_to_text_whisper(samples)
+    elif mode != "sr":
+        logging.error(f"Invalid mode specified: {mode}")
+        return None
 
-    with sr.Microphone(device_index=input_device) as source:
+    with _microphone as source:
         logging.info("Listening...")
-        audio = recognizer.listen(source)
+        audio = _recognizer.listen(source)
         logging.info("Audio captured.")
 
         try:
-            if mode == "sr":
-                # Using SpeechRecognition
-                text = recognizer.recognize_google(audio)
-                logging.info(f"You said: {text}")
-                return text
-            elif mode == "whisper":
-                # Save the audio to a temporary file for Whisper
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                    temp_file_name = temp_file.name
-                    # Save audio data
-                    with wave.open(temp_file_name, 'wb') as wf:
-                        wf.setnchannels(1)  # Mono
-                        wf.setsampwidth(2)  # Sample width in bytes
-                        wf.setframerate(44100)  # Sample rate
-                        wf.writeframes(audio.get_raw_data())  # Write audio data
-
-                # Call the Whisper transcription function
-                return speech_to_text_whisper(temp_file_name)
-            else:
-                logging.error(f"Invalid mode specified: {mode}")
-                return None
+            # Using SpeechRecognition
+            text = _recognizer.recognize_google(audio)
+            logging.info(f"You said: {text}")
+            return text
         except sr.UnknownValueError:
             logging.error("Could not understand the audio.")
             return None
@@ -240,69 +337,118 @@ def speech_to_text(input_device=INPUT_DEVICE_INDEX, mode="sr"):
             logging.error(f"An unexpected error occurred: {e}")
             return None
 
-
 @time_wrapper
-def speech_to_text(input_device=INPUT_DEVICE_INDEX, mode="sr"):
+def filter_response(input_text):
     """
-    Convert speech to text using either the SpeechRecognition library or Whisper.
-    :param input_device: The input device index to use.
-    :param mode: The mode of transcription ('sr' for SpeechRecognition or 'whisper' for Whisper).
-    :return: The recognized text or None if not recognized.
+    Filter out unwanted characters from the input text.
+    :param input_text: Input text to filter.
+    :return: Filtered text.
     """
-    recognizer = sr.Recognizer()
+    filtered_text = _FILTER_PATTERN.sub('', input_text)
+    # Computing the removed characters costs another full scan, so only
+    # do it when debug logging is actually enabled.
+    if filtered_text != input_text and logging.getLogger().isEnabledFor(logging.DEBUG):
+        removed_chars = ''.join(sorted(set(input_text) - set(filtered_text)))
+        logging.debug(f"Removed characters: {removed_chars}")
+    return filtered_text
 
-    with sr.Microphone(device_index=input_device) as source:
-        logging.info("Listening...")
-        audio = recognizer.listen(source)
-        logging.info("Audio captured.")
 
+# Queues connecting the Ollama stream to TTS and TTS to playback, so each
+# stage can work on a sentence while the next one is still being generated.
+sentence_queue = queue.Queue()
+playback_queue = queue.Queue()
+_tts_counter = itertools.count()
+
+
+def _numbered_path(path, number):
+    """
+    Derive a per-sentence output path from a base path.
+    :param path: The base output path from the config.
+    :param number: The sentence number within the session.
+    :return: The numbered path.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}_{number}{ext}"
+
+
+def _remove_audio_file(path):
+    """
+    Delete a per-sentence audio file, ignoring files that were never written.
+    :param path: The path to delete.
+    :return: None
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def queue_sentence(sentence):
+    """
+    Filter a streamed sentence and hand it to the TTS worker.
+    :param sentence: A complete sentence from the Ollama stream.
+    :return: None
+    """
+    sentence = filter_response(sentence)
+    if sentence:
+        sentence_queue.put(sentence)
+
+
+def tts_worker():
+    """
+    Convert queued sentences to speech and enqueue the resulting WAVs for playback.
+    :return: None
+    """
+    while True:
+        sentence = sentence_queue.get()
         try:
-            if mode == "sr":
-                # Using SpeechRecognition
-                text = recognizer.recognize_google(audio)
-                logging.info(f"You said: {text}")
-                return text
-            elif mode == "whisper":
-                # Save the audio to a temporary file for Whisper
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                    temp_file_name = temp_file.name
-                    # Save audio data
-                    with wave.open(temp_file_name, 'wb') as wf:
-                        wf.setnchannels(1)  # Mono
-                        wf.setsampwidth(2)  # Sample width in bytes
-                        wf.setframerate(44100)  # Sample rate
-                        wf.writeframes(audio.get_raw_data())  # Write audio data
-
-                # Call the Whisper transcription function
-                return speech_to_text_whisper(temp_file_name)
-            else:
-                logging.error(f"Invalid mode specified: {mode}")
-                return None
-        except sr.UnknownValueError:
-            logging.error("Could not understand the audio.")
-            return None
-        except sr.RequestError:
-            logging.error("Speech recognition service request failed.")
-            return None
-        except Exception as e:
-            logging.error(f"An unexpected error occurred: {e}")
-            return None
+            number = next(_tts_counter)
+            tts_path = _numbered_path(APPLIO_TTS_OUTPUT_PATH, number)
+            rvc_path = _numbered_path(APPLIO_RVC_OUTPUT_PATH, number)
+            audio_file = convert_text_to_speech(sentence, tts_path, rvc_path)
+            # The intermediate TTS output is only consumed by RVC, so it
+            # can go as soon as the conversion has run.
+            _remove_audio_file(tts_path)
+            if audio_file:
+                playback_queue.put(audio_file)
+        finally:
+            sentence_queue.task_done()
+
+
+def playback_worker():
+    """
+    Play queued WAV files in order.
+    :return: None
+    """
+    while True:
+        audio_file = playback_queue.get()
+        try:
+            play_audio(audio_file, output_device=OUTPUT_DEVICE_INDEX)
+            # Each sentence gets its own numbered WAV, so clean up after
+            # playing to keep a long session from filling the output dir.
+            _remove_audio_file(audio_file)
+        finally:
+            playback_queue.task_done()
+
 
 @time_wrapper
-def filter_response(input_text, filtered_chars=FILTERED_CHARS):
+def warm_up_models():
     """
-    Filter out unwanted characters from the input text.
-    :param input_text: Input text to filter.
-    :param filtered_chars: Characters to filter out.
-    :return: Filtered text.
+    Run dummy inference through Whisper and the LLM backend so the one-off
+    startup costs are paid before the user's first utterance.
+    :return: None
     """
-    sym = [' ', '?', '!', '.', ',', ':', ';', '-', "'", '*']
-    filtered_text = ''.join(
-        char for char in input_text if (char.isalnum() or char in sym) and char not in filtered_chars)
-    if filtered_text != input_text:
-        removed_chars = ''.join(char for char in input_text if char not in filtered_text)
-        logging.info(f"Removed characters: {removed_chars}")
-    return filtered_text
+    try:
+        # transcribe is lazy; consuming the segments forces kernel and
+        # mel-filter initialization on one second of silence.
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)
+        list(segments)
+    except Exception as e:
+        logging.warning(f"Whisper warm-up failed: {e}")
+    try:
+        LLM_BACKEND.warm_up()
+    except Exception as e:
+        logging.warning(f"LLM warm-up failed: {e}")
 
 
 def main():
@@ -312,26 +458,32 @@ def main():
     """
     user_id = "user"
     conversation_history = load_conversation_history(user_id)
+    warm_up_models()
     logging.info("Welcome to the Voicetral!\nTalk to me or say 'exit' to end and save the conversation")
 
+    # TTS and playback run on background threads so the user hears the
+    # first sentence while later tokens are still being generated.
+    threading.Thread(target=tts_worker, daemon=True).start()
+    threading.Thread(target=playback_worker, daemon=True).start()
+
     while True:
+        # Wait until the previous reply has finished speaking before
+        # reopening the mic: with a shared speaker/mic pair (the default
+        # config points both at device 0) the VAD would endpoint on our
+        # own TTS audio and feed the reply back in as the next user turn.
+        # TTS and playback still overlap with the LLM stream, which is
+        # where the latency win is.
+        sentence_queue.join()
+        playback_queue.join()
+
         user_input = speech_to_text(input_device=INPUT_DEVICE_INDEX, mode="whisper")
         if user_input:
             if user_input.lower() == "exit":
                 save_conversation_history(user_id, conversation_history)
                 break
 
-            response = get_ollama_response(user_input, user_id, conversation_history=conversation_history)
-            response = filter_response(response)
-
-            tts_path = APPLIO_TTS_OUTPUT_PATH
-            rvc_path = APPLIO_RVC_OUTPUT_PATH
-            audio_file = convert_text_to_speech(response, tts_path, rvc_path)
-
-            if audio_file:
-                resampled_audio = resample_audio(audio_file)
-                if resampled_audio:
-                    play_audio(resampled_audio, output_device=OUTPUT_DEVICE_INDEX)
+            get_llm_response(user_input, user_id, conversation_history=conversation_history,
+                             on_sentence=queue_sentence)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
-import json
 import logging
 import os
 
+import orjson
+
 def save_conversation_history(user_id, conversation_history):
     """
     Saves the conversation history to a JSON file.
@@ -11,8 +12,13 @@ def save_conversation_history(user_id, conversation_history):
     """
     temp_path = f"conversation_history_{user_id}.json.temp"
     try:
-        with open(temp_path, "w") as file:
-            json.dump(conversation_history, file)
+        # orjson serializes to bytes in C, with no pure-Python escaping.
+        # fsync before the atomic replace so a crash can't leave a
+        # half-written file behind the final name.
+        with open(temp_path, "wb") as file:
+            file.write(orjson.dumps(conversation_history, option=orjson.OPT_NON_STR_KEYS))
+            file.flush()
+            os.fsync(file.fileno())
         os.replace(temp_path, f"conversation_history_{user_id}.json")
     except Exception as e:
         logging.error(f"Error saving conversation history: {e}")
@@ -25,8 +31,8 @@ def load_conversation_history(user_id):
     :return: The loaded conversation history or an empty dictionary if not found.
     """
     try:
-        with open(f"conversation_history_{user_id}.json", "r") as file:
-            return json.load(file)
+        with open(f"conversation_history_{user_id}.json", "rb") as file:
+            return orjson.loads(file.read())
     except FileNotFoundError:
         print(f"No previous conversation history found for user: {user_id}. Starting new conversation.")
         return {}